@@ -7,15 +7,20 @@ Kafka topics (api.md):
   Data      (consumer): otus-uas-logs, otus-uac-logs (ADR-028)
 """
 
-import json
+import atexit
+import collections
+import itertools
 import logging
 import os
-import queue
+import signal
+import sys
 import threading
 import time
 import uuid
+from concurrent.futures import Future
 from datetime import datetime, timezone
 
+import orjson
 from flask import Flask, Response, jsonify, render_template, request
 from kafka import KafkaConsumer, KafkaProducer
 from kafka.errors import KafkaError
@@ -42,10 +47,13 @@ RESPONSE_TOPIC = "otus-responses"
 INSTANCE_ID = f"webcli-{uuid.uuid4().hex[:8]}"
 
 # All supported commands (api.md §5)
-VALID_COMMANDS = {
+VALID_COMMANDS = frozenset({
     "task_create", "task_delete", "task_list", "task_status",
     "config_reload", "daemon_status", "daemon_stats", "daemon_shutdown",
-}
+})
+
+# Accepted /api/command targets ("*" broadcasts to every node)
+VALID_TARGETS = frozenset({"uas", "uac", "*"})
 
 # Max packets kept in memory per channel
 MAX_QUEUE_SIZE = 500
@@ -53,6 +61,16 @@ MAX_QUEUE_SIZE = 500
 # Response wait timeout (api.md §4 recommends 30 s)
 RESPONSE_TIMEOUT_S = 30
 
+# Fetch tuning for the high-rate packet topics: wait for bigger batches so
+# each poll wakes the consumer thread less often.  Not used for the
+# response topic, where it would delay command replies.
+PACKET_FETCH_OPTS = {
+    "fetch_min_bytes": 64 * 1024,
+    "fetch_max_wait_ms": 100,
+    "max_partition_fetch_bytes": 4 * 1024 * 1024,
+    "max_poll_records": 1000,
+}
+
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
@@ -61,27 +79,88 @@ log = logging.getLogger("console")
 
 app = Flask(__name__)
 
+# ─────────────────────────────────────────────
+# SSE ring buffer
+# ─────────────────────────────────────────────
+
+class RingBus:
+    """Single-writer ring buffer shared by all SSE readers of one stream.
+
+    The writer stores into the next slot and bumps ``head``; readers track
+    their own ``tail`` and drain ``[tail, head)``.  A reader that falls more
+    than ``size`` items behind skips ahead and loses the oldest items.
+    """
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.buf: list = [None] * size
+        self.head = 0
+        self._cond = threading.Condition()
+        self._waiters = 0
+
+    def publish(self, item) -> None:
+        self.buf[self.head % self.size] = item
+        self.head += 1
+        # Readers register under the lock before re-checking head, so an
+        # unlocked zero here means nobody can be left sleeping.
+        if self._waiters:
+            with self._cond:
+                self._cond.notify_all()
+
+    def read(self, tail: int, timeout: float) -> tuple[list, int]:
+        """Return items published since ``tail`` and the new cursor.
+
+        Blocks up to ``timeout`` seconds; returns an empty list on timeout.
+        """
+        if self.head == tail:
+            with self._cond:
+                self._waiters += 1
+                try:
+                    self._cond.wait_for(lambda: self.head != tail, timeout)
+                finally:
+                    self._waiters -= 1
+        head = self.head
+        tail = max(tail, head - self.size)
+        items = [self.buf[i % self.size] for i in range(tail, head)]
+        # Drop anything the writer overwrote while we were copying.  publish()
+        # stores into slot ``head`` before bumping ``head``, so that one
+        # extra slot may already hold a newer item too.
+        overrun = self.head + 1 - self.size - tail
+        if overrun > 0:
+            items = items[overrun:]
+        return items, head
+
+
+def _sse_frame(event: dict) -> bytes:
+    """Serialise an event once into a ready-to-send SSE ``data:`` frame."""
+    return b"data: " + orjson.dumps(event) + b"\n\n"
+
+
+_SSE_HEARTBEAT = b": heartbeat\n\n"
+
+
 # ─────────────────────────────────────────────
 # Shared packet queues — filled by background consumers
 # ─────────────────────────────────────────────
-packet_queues: dict[str, queue.Queue] = {
-    "uas": queue.Queue(maxsize=MAX_QUEUE_SIZE),
-    "uac": queue.Queue(maxsize=MAX_QUEUE_SIZE),
+packet_queues: dict[str, collections.deque] = {
+    "uas": collections.deque(maxlen=MAX_QUEUE_SIZE),
+    "uac": collections.deque(maxlen=MAX_QUEUE_SIZE),
 }
-
-# SSE subscriber lists — each subscriber gets its own queue
-sse_subscribers: dict[str, list[queue.Queue]] = {
-    "uas": [],
-    "uac": [],
+packet_lock = threading.Lock()
+
+# SSE fan-out — one shared ring of pre-encoded frames per stream, each SSE
+# generator keeps its own read cursor, so publishing costs the same
+# regardless of subscriber count.
+sse_buses: dict[str, RingBus] = {
+    "uas": RingBus(200),
+    "uac": RingBus(200),
 }
 
-# SSE subscribers for command responses (ADR-029)
-response_sse_subscribers: list[queue.Queue] = []
-
-sse_lock = threading.Lock()
+# SSE fan-out for command responses (ADR-029)
+response_bus = RingBus(100)
 
 # ADR-029: callers waiting for a specific response, keyed by request_id
-pending_responses: dict[str, queue.Queue] = {}
+pending_responses: dict[str, Future] = {}
 pending_lock = threading.Lock()
 
 
@@ -94,18 +173,66 @@ _producer_lock = threading.Lock()
 
 def get_producer() -> KafkaProducer:
     global _producer
+    # Fast path once created; the lock only guards first construction.
+    producer = _producer
+    if producer is not None:
+        return producer
     with _producer_lock:
         if _producer is None:
             _producer = KafkaProducer(
                 bootstrap_servers=KAFKA_BROKERS,
-                value_serializer=lambda v: json.dumps(v).encode("utf-8"),
+                value_serializer=orjson.dumps,
                 key_serializer=lambda k: k.encode("utf-8") if k else None,
                 retries=3,
                 acks="all",
+                # Let the client batch commands instead of flushing per send;
+                # correlation goes through pending_responses, not producer acks.
+                linger_ms=20,
+                batch_size=65536,
+                compression_type="lz4",
+                max_in_flight_requests_per_connection=5,
             )
+            # Deliver whatever is still buffered when the process exits.
+            atexit.register(_shutdown_producer)
         return _producer
 
 
+def _shutdown_producer() -> None:
+    """Flush buffered commands and close the producer (registered with atexit)."""
+    if _producer is None:
+        return
+    try:
+        _producer.flush(timeout=10)
+        _producer.close(timeout=10)
+    except Exception as exc:
+        log.warning("producer shutdown error: %s", exc)
+
+
+def _on_send_error(exc: BaseException) -> None:
+    log.warning("command send failed: %s", exc)
+
+
+def _produce_command(target: str, command: str, payload: dict | None,
+                     request_id: str) -> None:
+    """Build one KafkaCommand and hand it to the producer for every topic of
+    ``target`` ("*" fans the same message out to all command topics)."""
+    msg = {
+        "version": "v1",
+        "target": target,
+        "command": command,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "request_id": request_id,
+        "payload": payload or {},
+    }
+    if target == "*":
+        topics = COMMAND_TOPICS.values()
+    else:
+        topics = (COMMAND_TOPICS.get(target, COMMAND_TOPICS["uas"]),)
+    producer = get_producer()
+    for topic in topics:
+        producer.send(topic, key=target, value=msg).add_errback(_on_send_error)
+
+
 def send_command(target: str, command: str, payload: dict | None = None) -> str:
     """Produce a KafkaCommand to the target node's command topic (api.md §3).
 
@@ -115,23 +242,11 @@ def send_command(target: str, command: str, payload: dict | None = None) -> str:
     Returns request_id for correlation with KafkaResponse.
     """
     request_id = str(uuid.uuid4())
-    msg = {
-        "version": "v1",
-        "target": target,
-        "command": command,
-        "timestamp": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
-        "request_id": request_id,
-        "payload": payload or {},
-    }
+    _produce_command(target, command, payload, request_id)
     if target == "*":
-        for t in COMMAND_TOPICS.values():
-            get_producer().send(t, key=target, value=msg)
         log.info("broadcast command=%s request_id=%s", command, request_id)
     else:
-        topic = COMMAND_TOPICS.get(target, COMMAND_TOPICS["uas"])
-        get_producer().send(topic, key=target, value=msg)
         log.info("command=%s target=%s request_id=%s", command, target, request_id)
-    get_producer().flush()
     return request_id
 
 
@@ -140,18 +255,19 @@ def send_command(target: str, command: str, payload: dict | None = None) -> str:
 # ─────────────────────────────────────────────
 
 def _make_consumer(topic_or_topics, group_id: str,
-                   offset_reset: str = "latest") -> KafkaConsumer:
+                   offset_reset: str = "latest", **fetch_opts) -> KafkaConsumer:
     topics = [topic_or_topics] if isinstance(topic_or_topics, str) else topic_or_topics
     return KafkaConsumer(
         *topics,
         bootstrap_servers=KAFKA_BROKERS,
         group_id=group_id,
         auto_offset_reset=offset_reset,
-        value_deserializer=lambda v: json.loads(v.decode("utf-8")),
+        value_deserializer=orjson.loads,
         enable_auto_commit=True,
         session_timeout_ms=30000,
         heartbeat_interval_ms=10000,
         max_poll_interval_ms=300000,
+        **fetch_opts,
     )
 
 
@@ -171,7 +287,7 @@ def _consumer_loop(consumer: KafkaConsumer, on_message) -> None:
 # Background consumer: captured packets (ADR-028)
 # ─────────────────────────────────────────────
 
-def _parse_packet_headers(msg) -> dict:
+def _parse_packet_headers(msg) -> tuple[dict[str, str], dict[str, str]]:
     """
     ADR-028: Kafka message Headers carry per-packet envelope metadata.
 
@@ -180,66 +296,58 @@ def _parse_packet_headers(msg) -> dict:
         src_ip, dst_ip, src_port, dst_port, timestamp
     Label headers are prefixed with 'l.' (e.g. l.sip.method, l.sip.call_id).
 
-    Returns a dict with:
-        _envelope      – non-label headers
-        _header_labels – label headers with the 'l.' prefix stripped
+    Returns (envelope, labels):
+        envelope – non-label headers
+        labels   – label headers with the 'l.' prefix stripped
     """
-    if not msg.headers:
-        return {}
-    headers = {k: v.decode("utf-8", errors="replace") for k, v in msg.headers}
-    label_headers = {k[2:]: v for k, v in headers.items() if k.startswith("l.")}
-    envelope = {k: v for k, v in headers.items() if not k.startswith("l.")}
-    return {"_envelope": envelope, "_header_labels": label_headers}
+    envelope: dict[str, str] = {}
+    labels: dict[str, str] = {}
+    for k, v in msg.headers or ():
+        if k.startswith("l."):
+            labels[k[2:]] = v.decode("utf-8", errors="replace")
+        else:
+            envelope[k] = v.decode("utf-8", errors="replace")
+    return envelope, labels
 
 
 def _handle_packet(channel: str, msg) -> None:
     packet = msg.value if isinstance(msg.value, dict) else {}
-    extra = _parse_packet_headers(msg)
+    envelope, labels = _parse_packet_headers(msg)
 
     # Merge header-extracted labels into packet["labels"] (ADR-028)
-    if extra.get("_header_labels"):
-        packet.setdefault("labels", {}).update(extra["_header_labels"])
-    packet["_envelope"] = extra.get("_envelope", {})
+    if labels:
+        packet.setdefault("labels", {}).update(labels)
+    packet["_envelope"] = envelope
     packet["_received_at"] = int(time.time() * 1000)
 
     # Normalise timestamp to integer milliseconds so the frontend can safely
     # call new Date(number).  Accepts: int/float ms, int/float seconds, or
     # numeric string.  Falls back to _received_at if the value is unusable.
     ts_raw = packet.get("timestamp")
-    if ts_raw is not None:
-        try:
-            ts_int = int(float(str(ts_raw)))
-            # Heuristic: < 10^11 ⇒ value is in seconds, convert to ms
-            if ts_int < 100_000_000_000:
-                ts_int *= 1000
-            packet["timestamp"] = ts_int
-        except (ValueError, TypeError):
-            packet["timestamp"] = packet["_received_at"]
-    else:
+    try:
+        if isinstance(ts_raw, (int, float)) and not isinstance(ts_raw, bool):
+            ts_int = int(ts_raw)
+        elif isinstance(ts_raw, str):
+            try:
+                ts_int = int(ts_raw)
+            except ValueError:
+                ts_int = int(float(ts_raw))
+        else:
+            ts_int = None
+    except (ValueError, OverflowError):
+        ts_int = None
+    if ts_int is None:
         packet["timestamp"] = packet["_received_at"]
+    else:
+        # Heuristic: < 10^11 ⇒ value is in seconds, convert to ms
+        packet["timestamp"] = ts_int * 1000 if ts_int < 100_000_000_000 else ts_int
 
     # Push to all SSE subscribers for this channel
-    with sse_lock:
-        dead = []
-        for q in sse_subscribers[channel]:
-            try:
-                q.put_nowait(packet)
-            except queue.Full:
-                dead.append(q)
-        for q in dead:
-            sse_subscribers[channel].remove(q)
+    sse_buses[channel].publish(_sse_frame(packet))
 
-    # Maintain ring buffer
-    pq = packet_queues[channel]
-    if pq.full():
-        try:
-            pq.get_nowait()
-        except queue.Empty:
-            pass
-    try:
-        pq.put_nowait(packet)
-    except queue.Full:
-        pass
+    # Maintain ring buffer (deque maxlen evicts the oldest packet)
+    with packet_lock:
+        packet_queues[channel].append(packet)
 
 
 def _start_packet_consumer(channel: str, topic: str) -> None:
@@ -247,7 +355,7 @@ def _start_packet_consumer(channel: str, topic: str) -> None:
         consumer = None
         try:
             log.info("packet consumer connecting channel=%s topic=%s", channel, topic)
-            consumer = _make_consumer(topic, f"console-{channel}")
+            consumer = _make_consumer(topic, f"console-{channel}", **PACKET_FETCH_OPTS)
             log.info("packet consumer ready channel=%s", channel)
             _consumer_loop(consumer, lambda msg, ch=channel: _handle_packet(ch, msg))
         except Exception as exc:
@@ -281,22 +389,11 @@ def _handle_response(msg) -> None:
     # Unblock any caller waiting for this request_id
     with pending_lock:
         waiter = pending_responses.pop(rid, None)
-    if waiter:
-        try:
-            waiter.put_nowait(resp)
-        except queue.Full:
-            pass
+    if waiter and not waiter.done():
+        waiter.set_result(resp)
 
     # Push to all SSE response subscribers
-    with sse_lock:
-        dead = []
-        for q in response_sse_subscribers:
-            try:
-                q.put_nowait(resp)
-            except queue.Full:
-                dead.append(q)
-        for q in dead:
-            response_sse_subscribers.remove(q)
+    response_bus.publish(_sse_frame(resp))
 
 
 def _start_response_consumer() -> None:
@@ -358,48 +455,43 @@ def api_command():
         payload: {} (command-specific, see api.md §5)
         wait:    true (default) | false — fire-and-forget
     """
-    body = request.get_json(force=True)
+    body = request.get_json(force=True, silent=True)
+    if not isinstance(body, dict):
+        return jsonify({"error": "request body must be a JSON object"}), 400
     target = body.get("target", "uas")
     command = body.get("command", "task_list")
     payload = body.get("payload", {})
     wait = body.get("wait", True)
 
-    if target not in ("uas", "uac", "*"):
+    if not isinstance(target, str) or target not in VALID_TARGETS:
         return jsonify({"error": f"invalid target: {target}"}), 400
-    if command not in VALID_COMMANDS:
+    if not isinstance(command, str) or command not in VALID_COMMANDS:
         return jsonify({"error": f"unknown command: {command}"}), 400
 
     request_id = str(uuid.uuid4())
 
     # Register waiter BEFORE sending to avoid a race where the response
     # arrives before we have subscribed.
-    resp_queue: queue.Queue = queue.Queue(maxsize=1)
+    waiter: Future = Future()
     if wait and target != "*":
         with pending_lock:
-            pending_responses[request_id] = resp_queue
+            pending_responses[request_id] = waiter
 
+    sent = False
     try:
-        msg = {
-            "version": "v1",
-            "target": target,
-            "command": command,
-            "timestamp": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
-            "request_id": request_id,
-            "payload": payload or {},
-        }
-        if target == "*":
-            for t in COMMAND_TOPICS.values():
-                get_producer().send(t, key=target, value=msg)
-        else:
-            topic = COMMAND_TOPICS.get(target, COMMAND_TOPICS["uas"])
-            get_producer().send(topic, key=target, value=msg)
-        get_producer().flush()
+        _produce_command(target, command, payload, request_id)
+        sent = True
         log.info("command=%s target=%s request_id=%s wait=%s",
                  command, target, request_id, wait)
+    except orjson.JSONEncodeError as e:
+        # e.g. integers outside the 64-bit range, which orjson rejects
+        return jsonify({"error": f"payload is not serialisable: {e}"}), 400
     except KafkaError as e:
-        with pending_lock:
-            pending_responses.pop(request_id, None)
         return jsonify({"error": str(e)}), 500
+    finally:
+        if not sent:
+            with pending_lock:
+                pending_responses.pop(request_id, None)
 
     # Broadcast or fire-and-forget — return immediately
     if not wait or target == "*":
@@ -407,13 +499,13 @@ def api_command():
 
     # Block until KafkaResponse arrives or timeout (api.md §4)
     try:
-        resp = resp_queue.get(timeout=RESPONSE_TIMEOUT_S)
+        resp = waiter.result(timeout=RESPONSE_TIMEOUT_S)
         return jsonify({
             "ok": resp.get("error") is None,
             "request_id": request_id,
             "response": resp,
         })
-    except queue.Empty:
+    except TimeoutError:
         with pending_lock:
             pending_responses.pop(request_id, None)
         return jsonify({
@@ -428,38 +520,36 @@ def api_packets(channel: str):
     """Return buffered packets (latest up to 200) for a channel."""
     if channel not in packet_queues:
         return jsonify({"error": "invalid channel"}), 400
-    items = list(packet_queues[channel].queue)
-    return jsonify({"channel": channel, "count": len(items), "packets": items[-200:]})
+    pq = packet_queues[channel]
+    with packet_lock:
+        count = len(pq)
+        items = list(itertools.islice(pq, max(0, count - 200), count))
+    return jsonify({"channel": channel, "count": count, "packets": items})
 
 
 @app.route("/api/stream/<channel>")
 def api_stream(channel: str):
     """Server-Sent Events stream for real-time captured packets."""
-    if channel not in sse_subscribers:
+    if channel not in sse_buses:
         return jsonify({"error": "invalid channel"}), 400
 
-    sub_queue: queue.Queue = queue.Queue(maxsize=200)
-    with sse_lock:
-        sse_subscribers[channel].append(sub_queue)
+    bus = sse_buses[channel]
 
     def generate():
+        tail = bus.head
         try:
             while True:
-                try:
-                    packet = sub_queue.get(timeout=15)
-                    yield f"data: {json.dumps(packet)}\n\n"
-                except queue.Empty:
-                    yield ": heartbeat\n\n"
+                frames, tail = bus.read(tail, timeout=15)
+                if not frames:
+                    yield _SSE_HEARTBEAT
+                yield from frames
         except GeneratorExit:
             pass
-        finally:
-            with sse_lock:
-                if sub_queue in sse_subscribers[channel]:
-                    sse_subscribers[channel].remove(sub_queue)
 
     return Response(
         generate(),
         mimetype="text/event-stream",
+        direct_passthrough=True,
         headers={
             "Cache-Control": "no-cache",
             "X-Accel-Buffering": "no",
@@ -470,28 +560,21 @@ def api_stream(channel: str):
 @app.route("/api/stream/responses")
 def api_stream_responses():
     """SSE stream for all command responses from otus-responses (ADR-029)."""
-    sub_queue: queue.Queue = queue.Queue(maxsize=100)
-    with sse_lock:
-        response_sse_subscribers.append(sub_queue)
-
     def generate():
+        tail = response_bus.head
         try:
             while True:
-                try:
-                    resp = sub_queue.get(timeout=15)
-                    yield f"data: {json.dumps(resp)}\n\n"
-                except queue.Empty:
-                    yield ": heartbeat\n\n"
+                frames, tail = response_bus.read(tail, timeout=15)
+                if not frames:
+                    yield _SSE_HEARTBEAT
+                yield from frames
         except GeneratorExit:
             pass
-        finally:
-            with sse_lock:
-                if sub_queue in response_sse_subscribers:
-                    response_sse_subscribers.remove(sub_queue)
 
     return Response(
         generate(),
         mimetype="text/event-stream",
+        direct_passthrough=True,
         headers={
             "Cache-Control": "no-cache",
             "X-Accel-Buffering": "no",
@@ -561,5 +644,8 @@ def task_template(channel: str):
 # Entry point
 # ─────────────────────────────────────────────
 if __name__ == "__main__":
+    # Turn SIGTERM (docker stop / pod termination) into a normal exit so the
+    # atexit hooks flush pending commands.
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
     start_background_consumers()
     app.run(host="0.0.0.0", port=8080, threaded=True)
@@ -7,26 +7,36 @@ SIPp replaces src/dst IP:port with the SDP-negotiated addresses at runtime.
 
 Usage: python3 gen_rtp_pcap.py [output.pcap]
 """
-import math
 import struct
 import sys
 
+import numpy as np
+
 OUTPUT = sys.argv[1] if len(sys.argv) > 1 else "/scenarios/rtp_g711u.pcap"
 
 # ── G.711 μ-law encoder ──────────────────────────────────────────────────────
-def pcm16_to_ulaw(sample: int) -> int:
-    """Encode a 16-bit signed PCM sample to 8-bit G.711 μ-law."""
+def _encode_ulaw(pcm: np.ndarray) -> np.ndarray:
+    """Compute G.711 μ-law bytes for an array of 16-bit signed PCM samples."""
     BIAS = 0x84
     CLIP = 32635
-    sample = max(-CLIP, min(CLIP, int(sample)))
-    sign = 0x80 if sample < 0 else 0x00
-    sample = abs(sample) + BIAS
-    exp = 7
-    for exp in range(7, -1, -1):
-        if sample >= (1 << (exp + 4)):
-            break
-    mantissa = (sample >> (exp + 3)) & 0x0F
-    return (~(sign | (exp << 4) | mantissa)) & 0xFF
+    pcm = np.clip(pcm.astype(np.int32), -CLIP, CLIP)
+    sign = np.where(pcm < 0, 0x80, 0x00)
+    mag = np.abs(pcm) + BIAS
+    # Highest exp in 7..0 with mag >= 1 << (exp + 4); frexp gives mag < 2**e
+    _, e = np.frexp(mag)
+    exp = np.clip(e - 5, 0, 7)
+    mantissa = (mag >> (exp + 3)) & 0x0F
+    return (~(sign | (exp << 4) | mantissa) & 0xFF).astype(np.uint8)
+
+
+# 16-bit input has only 65 536 possible values: encode each one once and
+# turn every later encode into a table lookup.
+_ULAW_TABLE = _encode_ulaw(np.arange(-32768, 32768))
+
+
+def pcm16_to_ulaw(pcm: np.ndarray) -> np.ndarray:
+    """Encode an array of 16-bit signed PCM samples to 8-bit G.711 μ-law."""
+    return _ULAW_TABLE[pcm.astype(np.int32) + 32768]
 
 
 # ── Audio parameters ─────────────────────────────────────────────────────────
@@ -37,70 +47,72 @@ AMPLITUDE     = 8000       # max ~24 dBm0 below clip
 DURATION_S    = 10         # seconds — SIPp loops the file if call is longer
 FRAMES        = DURATION_S * (SAMPLE_RATE // FRAME_SAMPLES)   # 500 frames
 
-# Pre-encode all frames
-encoded_frames = []
-for fi in range(FRAMES):
-    buf = bytearray(FRAME_SAMPLES)
-    for si in range(FRAME_SAMPLES):
-        t = (fi * FRAME_SAMPLES + si) / SAMPLE_RATE
-        pcm = AMPLITUDE * math.sin(2 * math.pi * FREQ * t)
-        buf[si] = pcm16_to_ulaw(pcm)
-    encoded_frames.append(bytes(buf))
-
-
-# ── Packet builders ───────────────────────────────────────────────────────────
-_ETH = (
-    b'\x00\x00\x00\x00\x00\x02'   # dst MAC (placeholder)
-    + b'\x00\x00\x00\x00\x00\x01' # src MAC (placeholder)
-    + b'\x08\x00'                  # EtherType IPv4
+# Pre-encode all frames in one pass over the whole tone
+t = np.arange(FRAMES * FRAME_SAMPLES) / SAMPLE_RATE
+pcm = (AMPLITUDE * np.sin(2 * np.pi * FREQ * t)).astype(np.int16)
+encoded_frames = pcm16_to_ulaw(pcm).reshape(FRAMES, FRAME_SAMPLES)
+
+
+# ── Packet layout ─────────────────────────────────────────────────────────────
+# Every frame has the same size, so all lengths are fixed up front.
+RTP_LEN = 12 + FRAME_SAMPLES
+UDP_LEN = 8 + RTP_LEN
+PKT_LEN = 14 + 20 + UDP_LEN
+# IPv4 total-length field as the generator has always written it: the UDP
+# header is counted twice, so it reads 8 bytes more than the packet holds.
+IP_TOTAL = 20 + 8 + UDP_LEN
+
+_PCAP_GH  = struct.Struct('<IHHiIII')  # pcap global header (little-endian)
+_PCAP_REC = struct.Struct('<IIII')     # pcap record header (little-endian)
+_HDRS = struct.Struct(                 # network headers (big-endian)
+    '>6s6sH'          # Ethernet
+    'BBHHHBBH4s4s'    # IPv4
+    'HHHH'            # UDP
+    'BBHII'           # RTP
 )
+_REC_LEN = _PCAP_REC.size + PKT_LEN
 
-def _ip(payload_len: int) -> bytes:
-    total = 20 + 8 + payload_len
-    return struct.pack(
-        '>BBHHHBBH4s4s',
-        0x45, 0, total, 0, 0, 64, 17, 0,
-        b'\x0a\x14\x00\x14',   # src 10.20.0.20 (UAC, placeholder)
-        b'\x0a\x14\x00\x0a',   # dst 10.20.0.10 (UAS, placeholder)
-    )
 
-def _udp(payload_len: int) -> bytes:
-    return struct.pack('>HHHH', 10100, 10000, 8 + payload_len, 0)
+# ── Write pcap ────────────────────────────────────────────────────────────────
+out = bytearray(_PCAP_GH.size + FRAMES * _REC_LEN)
+_PCAP_GH.pack_into(out, 0,
+    0xa1b2c3d4,   # magic
+    2, 4,         # version 2.4
+    0,            # timezone offset
+    0,            # timestamp accuracy
+    65535,        # snaplen
+    1,            # link type: Ethernet
+)
 
-def _rtp(seq: int, timestamp: int) -> bytes:
-    return struct.pack(
-        '>BBHII',
+for i in range(FRAMES):
+    off = _PCAP_GH.size + i * _REC_LEN
+    ts_us  = i * 20_000           # 20 ms increments
+    ts_sec = ts_us // 1_000_000
+    ts_rem = ts_us % 1_000_000
+    _PCAP_REC.pack_into(out, off, ts_sec, ts_rem, PKT_LEN, PKT_LEN)
+    _HDRS.pack_into(out, off + _PCAP_REC.size,
+        # Ethernet
+        b'\x00\x00\x00\x00\x00\x02',  # dst MAC (placeholder)
+        b'\x00\x00\x00\x00\x00\x01',  # src MAC (placeholder)
+        0x0800,                        # EtherType IPv4
+        # IPv4
+        0x45, 0, IP_TOTAL, 0, 0, 64, 17, 0,
+        b'\x0a\x14\x00\x14',   # src 10.20.0.20 (UAC, placeholder)
+        b'\x0a\x14\x00\x0a',   # dst 10.20.0.10 (UAS, placeholder)
+        # UDP
+        10100, 10000, UDP_LEN, 0,
+        # RTP
         0x80,           # V=2, P=0, X=0, CC=0
         0x00,           # M=0, PT=0 (PCMU / G.711 μ-law)
-        seq & 0xFFFF,
-        timestamp,
+        i & 0xFFFF,     # sequence number
+        i * FRAME_SAMPLES,
         0xDEADBEEF,     # SSRC (placeholder — SIPp keeps it unchanged)
     )
+    payload = off + _PCAP_REC.size + _HDRS.size
+    # Copy the frame's row straight out of the encoded array
+    out[payload:payload + FRAME_SAMPLES] = memoryview(encoded_frames[i])
 
-
-# ── Write pcap ────────────────────────────────────────────────────────────────
 with open(OUTPUT, 'wb') as f:
-    # pcap global header (little-endian)
-    f.write(struct.pack('<IHHiIII',
-        0xa1b2c3d4,   # magic
-        2, 4,         # version 2.4
-        0,            # timezone offset
-        0,            # timestamp accuracy
-        65535,        # snaplen
-        1,            # link type: Ethernet
-    ))
-
-    for i, frame in enumerate(encoded_frames):
-        rtp_payload = _rtp(i, i * FRAME_SAMPLES) + frame
-        udp_payload = _udp(len(rtp_payload))
-        ip_payload  = _ip(len(udp_payload) + len(rtp_payload))
-        pkt = _ETH + ip_payload + udp_payload + rtp_payload
-
-        ts_us  = i * 20_000           # 20 ms increments
-        ts_sec = ts_us // 1_000_000
-        ts_rem = ts_us % 1_000_000
-        # pcap record header
-        f.write(struct.pack('<IIII', ts_sec, ts_rem, len(pkt), len(pkt)))
-        f.write(pkt)
+    f.write(out)
 
 print(f"Generated {FRAMES} frames ({DURATION_S}s, 440 Hz G.711 PCMU) → {OUTPUT}")